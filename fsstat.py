@@ -1,36 +1,721 @@
 """Get information about a FAT32 filesystem and each file."""
+import abc
+import fnmatch
+import glob
+import hashlib
 import json
 import os
+import re
 import sys
+import threading
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+from itertools import zip_longest
 from typing import Optional
 
 import hw4utils
 
+try:
+    import zstandard
+except ImportError:  # only needed for seekable zstd images
+    zstandard = None
+
 
 def unpack(data: bytes, signed=False, byteorder="little") -> int:
     """Unpack a single value from bytes"""
     return int.from_bytes(data, byteorder=byteorder, signed=signed)
 
 
+# MBR partition types whose EBR chains we follow, and the protective type
+# that marks a GPT disk
+EXTENDED_PARTITION_TYPES = {0x05, 0x0F, 0x85}
+GPT_PROTECTIVE_TYPE = 0xEE
+# footer magic of the zstd seekable format's seek table
+ZSTD_SEEKABLE_MAGIC = 0x8F92EAB1
+
+
+class FileSource:
+    """Random-access reader over a file, relative to a byte offset.
+
+    Every read of a Fat goes through a block source, so a volume that starts
+    part way into a whole-disk image is read in place.
+    """
+
+    def __init__(self, filename, offset=0):
+        self.filename = filename
+        self.offset = offset
+        self.file = open(filename, "rb")
+
+    def read(self, offset: int, size: int) -> bytes:
+        """Read up to size bytes at offset (relative to self.offset)."""
+        self.file.seek(self.offset + offset)
+        return self.file.read(size)
+
+    def close(self):
+        self.file.close()
+
+
+class SplitSource:
+    """Random-access reader presenting split segments (.001, .002, ...) as one file."""
+
+    def __init__(self, filenames: list, offset=0):
+        self.filenames = filenames
+        self.offset = offset
+        self.files = [open(filename, "rb") for filename in filenames]
+        # starting byte of each segment within the joined address space
+        self.starts = []
+        total = 0
+        for filename in filenames:
+            self.starts.append(total)
+            total += os.path.getsize(filename)
+        self.size = total
+
+    def read(self, offset: int, size: int) -> bytes:
+        """Read up to size bytes at offset, crossing segment boundaries."""
+        offset += self.offset
+        chunks = []
+        segment = bisect_right(self.starts, offset) - 1
+        while size > 0 and 0 <= segment < len(self.files):
+            file = self.files[segment]
+            file.seek(offset - self.starts[segment])
+            data = file.read(size)
+            if data:
+                chunks.append(data)
+                offset += len(data)
+                size -= len(data)
+            segment += 1
+        return b"".join(chunks)
+
+    def close(self):
+        for file in self.files:
+            file.close()
+
+
+class _ChunkedSource(abc.ABC):
+    """Random-access reader over a file compressed in independent chunks.
+
+    Subclasses fill in self.starts (uncompressed start of each chunk, in
+    order) and self.extents (compressed offset and size of each chunk), and
+    implement _decode(). Only the chunks a read touches are decompressed, and
+    decoded chunks are kept in a byte-budgeted LRU cache.
+    """
+
+    def __init__(self, filename, offset=0, cache_bytes=32 * 1024 * 1024):
+        self.filename = filename
+        self.offset = offset
+        self.file = open(filename, "rb")
+        self.starts = []
+        self.extents = []
+        self.max_bytes = cache_bytes
+        self.chunks = OrderedDict()
+        self.cached_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def read(self, offset: int, size: int) -> bytes:
+        """Read up to size bytes at an uncompressed offset."""
+        offset += self.offset
+        chunks = []
+        index = bisect_right(self.starts, offset) - 1
+        while size > 0 and 0 <= index < len(self.starts):
+            start = offset - self.starts[index]
+            data = self._chunk(index)[start : start + size]
+            if not data:
+                break
+            chunks.append(data)
+            offset += len(data)
+            size -= len(data)
+            index += 1
+        return b"".join(chunks)
+
+    def _chunk(self, index: int) -> bytes:
+        """Return a decoded chunk, from the cache if possible."""
+        if index in self.chunks:
+            self.chunks.move_to_end(index)
+            self.hits += 1
+            return self.chunks[index]
+        self.misses += 1
+        compressed_offset, compressed_size = self.extents[index]
+        self.file.seek(compressed_offset)
+        data = self._decode(index, self.file.read(compressed_size))
+        self.chunks[index] = data
+        self.cached_bytes += len(data)
+        while self.cached_bytes > self.max_bytes and len(self.chunks) > 1:
+            _, evicted = self.chunks.popitem(last=False)
+            self.cached_bytes -= len(evicted)
+        return data
+
+    @abc.abstractmethod
+    def _decode(self, index: int, data: bytes) -> bytes:
+        """Decompress the compressed bytes of chunk index."""
+
+    def stats(self) -> dict:
+        """Return hit/miss counters of the decoded-chunk cache."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "chunks": len(self.chunks),
+            "bytes": self.cached_bytes,
+        }
+
+    def close(self):
+        self.file.close()
+
+
+class BgzfSource(_ChunkedSource):
+    """Random-access reader over a BGZF (blocked gzip) image.
+
+    BGZF is a series of gzip members of at most 64 KiB each, written by
+    bgzip. The block index is loaded from a bgzip .gzi file if one exists,
+    otherwise it is built by hopping from header to header without
+    decompressing anything.
+    """
+
+    def __init__(self, filename, offset=0, cache_bytes=32 * 1024 * 1024):
+        super().__init__(filename, offset, cache_bytes)
+        if os.path.exists(filename + ".gzi"):
+            self._load_gzi(filename + ".gzi")
+        else:
+            self._scan_blocks()
+
+    def _scan_blocks(self):
+        """Build the block index from the BSIZE and ISIZE fields of each block."""
+        file_size = os.path.getsize(self.filename)
+        compressed_offset = 0
+        uncompressed_offset = 0
+        while compressed_offset < file_size:
+            self.file.seek(compressed_offset)
+            header = self.file.read(18)
+            if header[0:4] != b"\x1f\x8b\x08\x04" or header[12:14] != b"BC":
+                raise ValueError(
+                    f"{self.filename}: bad BGZF block at {compressed_offset}"
+                )
+            block_size = unpack(header[16:18]) + 1
+            self.file.seek(compressed_offset + block_size - 4)
+            uncompressed_size = unpack(self.file.read(4))
+            # skip empty blocks such as the EOF marker
+            if uncompressed_size:
+                self.starts.append(uncompressed_offset)
+                self.extents.append((compressed_offset, block_size))
+            compressed_offset += block_size
+            uncompressed_offset += uncompressed_size
+
+    def _load_gzi(self, index_filename):
+        """Load a bgzip .gzi index: a count, then (compressed, uncompressed) pairs."""
+        with open(index_filename, "rb") as index_file:
+            data = index_file.read()
+        count = unpack(data[0:8])
+        pairs = [(0, 0)]
+        for i in range(count):
+            entry = data[8 + i * 16 : 8 + (i + 1) * 16]
+            pairs.append((unpack(entry[0:8]), unpack(entry[8:16])))
+        file_size = os.path.getsize(self.filename)
+        for i, (compressed_offset, uncompressed_offset) in enumerate(pairs):
+            end = pairs[i + 1][0] if i + 1 < len(pairs) else file_size
+            self.starts.append(uncompressed_offset)
+            self.extents.append((compressed_offset, end - compressed_offset))
+
+    def _decode(self, index: int, data: bytes) -> bytes:
+        # wbits=31 expects a single gzip member
+        return zlib.decompress(data, 31)
+
+
+class ZstdSeekableSource(_ChunkedSource):
+    """Random-access reader over a zstd image in the seekable format.
+
+    The seek table at the end of the file lists the compressed and
+    decompressed size of every frame. Requires the zstandard package.
+    """
+
+    def __init__(self, filename, offset=0, cache_bytes=32 * 1024 * 1024):
+        if zstandard is None:
+            raise ImportError("reading seekable zstd images requires zstandard")
+        super().__init__(filename, offset, cache_bytes)
+        self.decompressor = zstandard.ZstdDecompressor()
+        # decompressed size of each frame, from the seek table
+        self.sizes = []
+        self._load_seek_table()
+
+    def _load_seek_table(self):
+        """Parse the seek table frame at the end of the file."""
+        file_size = os.path.getsize(self.filename)
+        self.file.seek(file_size - 9)
+        footer = self.file.read(9)
+        if unpack(footer[5:9]) != ZSTD_SEEKABLE_MAGIC:
+            raise ValueError(f"{self.filename}: no zstd seek table found")
+        frame_count = unpack(footer[0:4])
+        entry_size = 12 if footer[4] & 0x80 else 8
+        self.file.seek(file_size - 9 - frame_count * entry_size)
+        table = self.file.read(frame_count * entry_size)
+
+        compressed_offset = 0
+        uncompressed_offset = 0
+        for i in range(frame_count):
+            entry = table[i * entry_size : (i + 1) * entry_size]
+            compressed_size = unpack(entry[0:4])
+            uncompressed_size = unpack(entry[4:8])
+            # skip empty frames; they hold no data to read
+            if uncompressed_size:
+                self.starts.append(uncompressed_offset)
+                self.extents.append((compressed_offset, compressed_size))
+                self.sizes.append(uncompressed_size)
+            compressed_offset += compressed_size
+            uncompressed_offset += uncompressed_size
+
+    def _decode(self, index: int, data: bytes) -> bytes:
+        # frames need not record their content size, but the seek table does
+        return self.decompressor.decompress(data, max_output_size=self.sizes[index])
+
+
+def open_source(filename, offset=0):
+    """Open the block source suited to an image file.
+
+    Split raw images are recognised by a numeric extension (image.001) and
+    the remaining segments are picked up in order. The segment given must
+    be the first of the series and the series must have no gaps, otherwise
+    a ValueError is raised. BGZF and seekable zstd images are recognised by
+    their magic bytes. Anything else is read as a plain raw image. A plain
+    (non-blocked) gzip file cannot be read at random and is rejected.
+    """
+    match = re.fullmatch(r"(.*)\.(\d{3})", filename)
+    if match:
+        stem, first = match.group(1), int(match.group(2))
+        numbers = sorted(
+            int(name[-3:]) for name in glob.glob(glob.escape(stem) + ".[0-9][0-9][0-9]")
+        )
+        if first not in numbers:
+            raise FileNotFoundError(filename)
+        if numbers[0] != first:
+            raise ValueError(
+                f"{filename}: split image starts at {stem}.{numbers[0]:03d}"
+            )
+        missing = sorted(set(range(first, numbers[-1])) - set(numbers))
+        if missing:
+            raise ValueError(f"{filename}: split image lacks {stem}.{missing[0]:03d}")
+        return SplitSource([f"{stem}.{number:03d}" for number in numbers], offset)
+
+    with open(filename, "rb") as file:
+        header = file.read(18)
+        file.seek(max(0, os.path.getsize(filename) - 4))
+        trailer = file.read(4)
+    if header[0:2] == b"\x1f\x8b":
+        if header[3] & 0x04 and header[12:14] == b"BC":
+            return BgzfSource(filename, offset)
+        raise ValueError(
+            f"{filename}: gzip is not seekable; recompress with bgzip or decompress it"
+        )
+    if len(trailer) == 4 and unpack(trailer) == ZSTD_SEEKABLE_MAGIC:
+        return ZstdSeekableSource(filename, offset)
+    return FileSource(filename, offset)
+
+
+class BlockCache:
+    """Byte-budgeted LRU cache of fixed-size blocks read from a block source.
+
+    Block 0 starts at byte base of the source, so blocks can be aligned to
+    clusters. When a read misses, the missing blocks are fetched with a
+    single read that also pulls in up to `readahead` following blocks, which
+    is what sequential cluster chains usually ask for next. Reads past the
+    end of the source return short (possibly empty) bytes, as a file does.
+    """
+
+    def __init__(
+        self,
+        source,
+        block_size: int,
+        max_bytes=8 * 1024 * 1024,
+        readahead=4,
+        base=0,
+    ):
+        self.source = source
+        self.block_size = block_size
+        self.base = base
+        self.max_bytes = max_bytes
+        self.readahead = readahead
+        self.blocks = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def read(self, offset: int, size: int) -> bytes:
+        """Read size bytes starting at offset, going through the cache."""
+        if size <= 0:
+            return b""
+        offset -= self.base
+        first = offset // self.block_size
+        last = (offset + size - 1) // self.block_size
+
+        block = first
+        while block <= last:
+            if block in self.blocks:
+                self.blocks.move_to_end(block)
+                self.hits += 1
+                block += 1
+                continue
+            # fetch the whole run of missing blocks (plus readahead) at once
+            end = block
+            while end < last and end + 1 not in self.blocks:
+                end += 1
+            self.misses += end - block + 1
+            end += self.readahead
+            while end > last and end in self.blocks:
+                end -= 1
+            self._fill(block, end)
+            block = end + 1
+
+        data = b"".join(self._block(n) for n in range(first, last + 1))
+        start = offset - first * self.block_size
+        return data[start : start + size]
+
+    def _block(self, number: int) -> bytes:
+        """Return a block, re-reading it if it was evicted by a later fill.
+
+        Blocks past the end of the source are never stored, so they come
+        back empty.
+        """
+        if number not in self.blocks:
+            self._fill(number, number)
+        return self.blocks.get(number, b"")
+
+    def _fill(self, first: int, last: int):
+        """Read blocks first..last in one request and store them."""
+        start = self.base + first * self.block_size
+        size = (last - first + 1) * self.block_size
+        if start < 0:
+            # the first block starts before the source; nothing is there
+            data = bytes(-start) + self.source.read(0, size + start)
+        else:
+            data = self.source.read(start, size)
+        for i in range(last - first + 1):
+            chunk = data[i * self.block_size : (i + 1) * self.block_size]
+            if not chunk:
+                break
+            self._store(first + i, chunk)
+
+    def _store(self, number: int, chunk: bytes):
+        """Insert a block and evict least recently used blocks over budget."""
+        if number in self.blocks:
+            self.size -= len(self.blocks.pop(number))
+        self.blocks[number] = chunk
+        self.size += len(chunk)
+        while self.size > self.max_bytes and len(self.blocks) > 1:
+            _, evicted = self.blocks.popitem(last=False)
+            self.size -= len(evicted)
+
+    def stats(self) -> dict:
+        """Return hit/miss counters and current cache occupancy."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "blocks": len(self.blocks),
+            "bytes": self.size,
+        }
+
+
+class FatTable:
+    """A file allocation table that is read a page at a time, on demand.
+
+    Pages go through a BlockCache aligned to the start of the table, so
+    memory is bounded by max_bytes and only the pages holding entries that
+    were looked up are ever read.
+    Whole-table work should use chunks(), which streams the table in large
+    sequential reads without going through the cache.
+    """
+
+    def __init__(
+        self, source, offset: int, size: int, page_size=4096, max_bytes=4 * 1024 * 1024
+    ):
+        self.source = source
+        self.offset = offset
+        self.size = size
+        self.pages = BlockCache(source, page_size, max_bytes, base=offset)
+
+    def entry(self, cluster: int) -> int:
+        """Return the table entry for a cluster; entries past the table are 0."""
+        if cluster < 0 or cluster * 4 + 4 > self.size:
+            return 0
+        return unpack(self.pages.read(self.offset + cluster * 4, 4))
+
+    def chunks(self, chunk_size=1024 * 1024):
+        """Yield (table offset, bytes) covering the whole table in order."""
+        for start in range(0, self.size, chunk_size):
+            length = min(chunk_size, self.size - start)
+            yield start, self.source.read(self.offset + start, length)
+
+
+class Timeline:
+    """Time-sorted index of directory entry timestamps, stored column-wise.
+
+    Each row is one timestamp of one entry: the POSIX time (FAT times have
+    no zone, so they are read as UTC), which event it was (an index into
+    EVENTS) and which entry (an index into paths and deleted). The columns
+    are arrays sorted by time, so a range query is two binary searches.
+    """
+
+    EVENTS = ("created", "accessed", "modified")
+
+    def __init__(self, times, events, entries, paths: list, deleted):
+        self.times = times
+        self.events = events
+        self.entries = entries
+        self.paths = paths
+        self.deleted = deleted
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def between(self, start=None, end=None) -> list[dict]:
+        """Return the rows with start <= time <= end, in time order.
+
+        start and end may be datetimes (naive ones are read as UTC),
+        POSIX times or None for an open end.
+        """
+        first = 0 if start is None else bisect_left(self.times, _posix(start))
+        last = len(self.times) if end is None else bisect_right(self.times, _posix(end))
+        return [self._row(i) for i in range(first, last)]
+
+    def _row(self, i: int) -> dict:
+        entry = self.entries[i]
+        return {
+            "time": datetime.fromtimestamp(self.times[i], timezone.utc)
+            .replace(tzinfo=None)
+            .isoformat(),
+            "event": self.EVENTS[self.events[i]],
+            "path": self.paths[entry],
+            "deleted": bool(self.deleted[entry]),
+        }
+
+
+def _posix(value) -> float:
+    """Convert a datetime (naive means UTC) or number to POSIX time."""
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    return float(value)
+
+
+class NameIndex:
+    """Compact index of entry names for Fat.find().
+
+    Entries are numbered in walk order and stored column-wise: short name,
+    long name (None if there is none), parent path (as an index into
+    self.parents), directory cluster, entry number and deleted flag. Two
+    lookup structures sit on top: a hash map from lower-case extension to
+    entry ids, and the lower-case names in sorted order (with their ids) so
+    a glob with a literal prefix only scans the names sharing that prefix.
+    Both hold the short and the long name of each entry, so an entry may
+    be found through either.
+    """
+
+    def __init__(self):
+        self.names = []
+        self.long_names = []
+        self.parents = []
+        self.parent_ids = array("L")
+        self.dir_clusters = array("L")
+        self.entry_nums = array("L")
+        self.deleted = array("B")
+        self.by_ext = {}
+        self.sorted_names = []
+        self.sorted_ids = array("L")
+
+    def add(self, parent_id: int, dir_cluster: int, record: dict):
+        entry = len(self.names)
+        self.names.append(record["name"])
+        self.long_names.append(record["long_name"])
+        self.parent_ids.append(parent_id)
+        self.dir_clusters.append(dir_cluster)
+        self.entry_nums.append(record["entry_num"])
+        self.deleted.append(record["deleted"])
+        for extension in {_extension(name) for name in self._names(entry)}:
+            self.by_ext.setdefault(extension, array("L")).append(entry)
+
+    def _names(self, entry: int) -> tuple:
+        """Return the short name of an entry, and its long name if it has one."""
+        if self.long_names[entry] is None:
+            return (self.names[entry],)
+        return (self.names[entry], self.long_names[entry])
+
+    def finish(self):
+        """Build the sorted name array once every entry has been added."""
+        pairs = sorted(
+            (name.lower(), entry)
+            for entry in range(len(self.names))
+            for name in self._names(entry)
+        )
+        self.sorted_names = [name for name, _ in pairs]
+        self.sorted_ids = array("L", (entry for _, entry in pairs))
+
+    def match(self, pattern=None, ext=None, deleted=None) -> list[int]:
+        """Return the ids of matching entries, in walk order."""
+        if ext is not None:
+            extensions = [ext] if isinstance(ext, str) else ext
+            candidates = set()
+            for extension in extensions:
+                candidates.update(self.by_ext.get(extension.lower().lstrip("."), ()))
+        else:
+            candidates = None
+
+        if isinstance(pattern, str):
+            glob_pattern = pattern.lower()
+            prefix = re.split(r"[*?\[]", glob_pattern, maxsplit=1)[0]
+            first = bisect_left(self.sorted_names, prefix)
+            ids = set()
+            for i in range(first, len(self.sorted_names)):
+                name = self.sorted_names[i]
+                if not name.startswith(prefix):
+                    break
+                if fnmatch.fnmatchcase(name, glob_pattern):
+                    ids.add(self.sorted_ids[i])
+            candidates = ids if candidates is None else candidates & ids
+        elif pattern is not None:
+            # regular expressions cannot use the sorted array
+            pool = range(len(self.names)) if candidates is None else candidates
+            candidates = {
+                i for i in pool if any(pattern.search(n) for n in self._names(i))
+            }
+
+        if candidates is None:
+            candidates = range(len(self.names))
+        return sorted(
+            i for i in candidates if deleted is None or bool(self.deleted[i]) == deleted
+        )
+
+
+def _extension(name: str) -> str:
+    """Return the lower-case extension of a name, or "" if it has none."""
+    return name.rpartition(".")[2].lower() if "." in name else ""
+
+
+def _long_name(run: list[bytes], short_name: bytes) -> Optional[str]:
+    """Join a run of lfn entries (in directory order) into a long name.
+
+    The run is stored last part first, so its sequence numbers must count
+    down to 1 with the first entry flagged 0x40, and every entry must carry
+    the checksum of short_name. Returns None if the run does not check out.
+    """
+    checksum = hw4utils.lfn_checksum(short_name)
+    parts = []
+    for position, entry in enumerate(run):
+        sequence = len(run) - position
+        if entry[0] & 0x1F != sequence or entry[13] != checksum:
+            return None
+        if (position == 0) != bool(entry[0] & 0x40):
+            return None
+        parts.append(entry[1:11] + entry[14:26] + entry[28:32])
+    name = b"".join(reversed(parts)).decode("utf-16-le", errors="replace")
+    return name.split("\x00", 1)[0]
+
+
+class _StreamHasher:
+    """Feeds one file's chunks to its hashers in logical order.
+
+    Pool threads may run a file's feed() calls out of order, so early
+    arrivals wait in self.pending until the chunks before them have been
+    hashed. The lock lets pool threads feed different files at once while
+    keeping each file's updates serialized.
+    """
+
+    def __init__(self, algorithms):
+        self.hashers = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+        self.lock = threading.Lock()
+        self.next_index = 0
+        self.pending = {}
+
+    def feed(self, index: int, data: bytes):
+        with self.lock:
+            self.pending[index] = data
+            while self.next_index in self.pending:
+                data = self.pending.pop(self.next_index)
+                for hasher in self.hashers.values():
+                    # hashlib releases the GIL for large updates
+                    hasher.update(data)
+                self.next_index += 1
+
+    def hexdigests(self) -> dict:
+        return {name: hasher.hexdigest() for name, hasher in self.hashers.items()}
+
+
+class FileHashes(dict):
+    """Digests from Fat.hash_files(): (content_cluster, filesize) -> {algorithm: hex digest}.
+
+    Cross-linked entries can share a first cluster with different sizes,
+    so the size is part of the key.
+    """
+
+    def __init__(self, algorithms, digests=()):
+        super().__init__(digests)
+        self.algorithms = tuple(algorithms)
+        self.empty = {
+            algorithm: hashlib.new(algorithm).hexdigest() for algorithm in algorithms
+        }
+
+    def lookup(self, record: dict) -> dict:
+        """Return the digests for a file record, None for each if unknown.
+
+        Deleted files have none; zero-length files own no clusters, so they
+        get the digests of empty input.
+        """
+        if record["deleted"]:
+            digests = {}
+        elif record["filesize"] == 0:
+            digests = self.empty
+        else:
+            digests = self.get((record["content_cluster"], record["filesize"]), {})
+        return {algorithm: digests.get(algorithm) for algorithm in self.algorithms}
+
+
 class Fat:
-    def __init__(self, filename):
-        """Parses a FAT32 filesystem"""
+    def __init__(
+        self,
+        filename,
+        offset=0,
+        cache_bytes=8 * 1024 * 1024,
+        readahead=4,
+        fat_cache_bytes=4 * 1024 * 1024,
+    ):
+        """Parses a FAT32 filesystem
+
+        filename may be a raw image, the first segment of a split image or a
+        seekable compressed image (see open_source). The volume starts offset
+        bytes into the image (see find_partitions).
+        Data reads go through a BlockCache of cluster-sized blocks holding
+        at most cache_bytes bytes. FAT0 is paged in on demand (see FatTable)
+        and holds at most fat_cache_bytes bytes.
+        """
         self.filename = filename
-        self.file = open(self.filename, "rb")
+        self.source = open_source(self.filename, offset)
         # set of key/value pairs parsed from the "Reserved"
         # sector of the filesystem
         self.boot = dict()
+        # built by find() on first use
+        self.name_index = None
+        self.fat_cache_bytes = fat_cache_bytes
         self._parse_reserved_sector()
+        # number blocks from the data region so each cluster is one block
+        self.cache = BlockCache(
+            self.source,
+            self.boot["bytes_per_cluster"],
+            cache_bytes,
+            readahead,
+            base=self.boot["data_start"] * self.boot["bytes_per_sector"],
+        )
 
     def __del__(self):
         """Called when the object is destroyed."""
         # close the open file reader
-        self.file.close()
+        if hasattr(self, "source"):
+            self.source.close()
 
     def _parse_reserved_sector(self):
         """Parse information from the "Reserved" sector of the filesystem.
 
-        The start of the FAT32 must be at the start of self.file.
+        The start of the FAT32 must be at offset 0 of self.source.
 
         Stores the following keys in the self.boot dictionary:
             bytes_per_sector
@@ -46,11 +731,12 @@ class Fat:
             data_start
             data_end
 
-        This function also stores fat0 in self.fat.
+        This function also stores fat0 in self.fat, as a FatTable that reads
+        its pages on demand, so nothing past the boot sector is read here.
 
         Refer to Carrier Chapters 9 and 10.
         """
-        boot_sector = self.file.read(512)
+        boot_sector = self.source.read(0, 512)
 
         bytes_per_sector = unpack(boot_sector[11:13])
         sectors_per_cluster = unpack(boot_sector[13:14])
@@ -84,19 +770,29 @@ class Fat:
             "data_end": data_end,
         }
 
-        self.file.seek(fat0_sector_start * bytes_per_sector)
-        fat0_sector_size = fat0_sector_end - fat0_sector_start
-        fat0 = self.file.read((fat0_sector_size) * bytes_per_sector)
-        self.fat = fat0
+        self.fat = FatTable(
+            self.source,
+            fat0_sector_start * bytes_per_sector,
+            sectors_per_fat * bytes_per_sector,
+            max_bytes=self.fat_cache_bytes,
+        )
+
+    def info(self, hash_files=False, timestamps=False):
+        """Print already-parsed information about the FAT filesystem as a json string
 
-    def info(self):
-        """Print already-parsed information about the FAT filesystem as a json string"""
+        If hash_files is True, file entries also carry md5 and sha256 keys
+        (see hash_files()). If timestamps is True, entries also carry their
+        created, accessed and modified times (see parse_dir()).
+        """
 
         # Print out all keys stored in the self.boot dictionary
         print(json.dumps(self.boot, indent=4))
 
         # Parsing the root directory
-        all_files = self.parse_dir(self.boot["root_dir_first_cluster"])
+        hashes = self.hash_files() if hash_files else None
+        all_files = self.parse_dir(
+            self.boot["root_dir_first_cluster"], hashes=hashes, timestamps=timestamps
+        )
         for file in all_files:
             print(json.dumps(file))
 
@@ -151,7 +847,7 @@ class Fat:
     def _get_fat_entry(self, cluster: int) -> int:
         """Given a cluster, returns the value of the corresponding entry in fat."""
         # Each entry in fat is 4 bytes
-        return unpack(self.fat[cluster * 4 : (cluster * 4) + 4])
+        return self.fat.entry(cluster)
 
     def _retrieve_data(self, cluster: int, ignore_unallocated=False) -> bytes:
         """Read in the data for a given file allocation table entry number
@@ -160,9 +856,10 @@ class Fat:
         Important: this function returns all bytes in the cluster, even the slack data past the
         actual filesize.
 
-        Because the cluster chain may be non-contiguous,
-        the sectors may be non-contiguous and we read in sectors one at a time.
-        The results are returned as a contiguous byte string.
+        Because the cluster chain may be non-contiguous, the sectors may be
+        non-contiguous too. Each run of consecutive sectors is read from the
+        block cache in one call, and the runs are joined into a contiguous
+        byte string.
 
         If ignore_unallocated is False, then when the cluster is unallocated,
         we return an empty bytes() object.
@@ -184,15 +881,21 @@ class Fat:
         else:
             sectors = self._get_sectors(cluster)
 
-        byte_sequence = b""
-
         bytes_per_sector = self.boot["bytes_per_sector"]
 
-        for sector in sectors:
-            self.file.seek(sector * bytes_per_sector)
-            byte_sequence += self.file.read(bytes_per_sector)
+        # coalesce runs of consecutive sectors so each run is one cache read
+        chunks = []
+        i = 0
+        while i < len(sectors):
+            run = 1
+            while i + run < len(sectors) and sectors[i + run] == sectors[i] + run:
+                run += 1
+            chunks.append(
+                self.cache.read(sectors[i] * bytes_per_sector, run * bytes_per_sector)
+            )
+            i += run
 
-        return byte_sequence
+        return b"".join(chunks)
 
     def _get_first_cluster(self, entry: bytes) -> int:
         """Returns the first cluster of the content of a given directory entry
@@ -243,7 +946,456 @@ class Fat:
 
         return (content, slack)
 
-    def parse_dir(self, cluster: int, parent="") -> list[dict]:
+    def _decode_entries(self, dir_data: bytes) -> list[dict]:
+        """Decode every 32-byte entry of a directory's data, without reading content.
+
+        Each dictionary contains entry_num, entry_type, name and deleted.
+        Every entry but lfn also has created, accessed and modified, as
+        naive datetimes or None when unset, and long_name: the name spelled
+        by the run of lfn entries just before it, or None when there is no
+        run or its checksums do not match the short name. Directory and file
+        entries also have content_cluster, and file entries (anything but
+        vol, lfn or dir) also have filesize.
+
+        returns:
+            list[dict]: list of dictionaries, one dict per entry
+        """
+        records = []
+        run = []
+        for count in range(len(dir_data) // 32):
+            entry = dir_data[count * 32 : (count + 1) * 32]
+            record = self._decode_entry(entry, count)
+            records.append(record)
+            if record["entry_type"] == "lfn":
+                run.append(entry)
+                continue
+            if run and record["name"] is not None:
+                record["long_name"] = _long_name(run, entry[0:11])
+            run = []
+        return records
+
+    def _decode_entry(self, entry: bytes, count: int) -> dict:
+        """Decode one 32-byte directory entry; see _decode_entries()."""
+        entry_type = hw4utils.get_entry_type(entry[11])
+        record = {
+            "entry_num": count,
+            "entry_type": entry_type,
+            "name": hw4utils.parse_name(entry),
+            "deleted": entry[0] == 0 or entry[0] == 0xE5,
+        }
+        if entry_type != "lfn":
+            created = hw4utils.parse_datetime(
+                unpack(entry[16:18]), unpack(entry[14:16]), entry[13]
+            )
+            accessed = hw4utils.parse_datetime(unpack(entry[18:20]))
+            modified = hw4utils.parse_datetime(
+                unpack(entry[24:26]), unpack(entry[22:24])
+            )
+            record["created"] = created
+            record["accessed"] = accessed
+            record["modified"] = modified
+            record["long_name"] = None
+        if entry_type not in ["vol", "lfn"]:
+            record["content_cluster"] = unpack(entry[26:28] + entry[20:22])
+        if entry_type not in ["vol", "lfn", "dir"]:
+            record["filesize"] = unpack(entry[28:32])
+        return record
+
+    def _walk(self, cluster: int, parent=""):
+        """Yield (parent, dir_cluster, record) for every entry below a directory.
+
+        Follows the same subdirectories as parse_dir, but only decodes the
+        entries (see _decode_entries) and never reads file content.
+        """
+        pending = [(cluster, parent)]
+        while pending:
+            cluster, parent = pending.pop()
+            dir_data = self._retrieve_data(cluster)
+            for record in self._decode_entries(dir_data):
+                yield parent, cluster, record
+            for _, name, subdir in reversed(self._subdirs(dir_data)):
+                pending.append((subdir, parent + "/" + name))
+
+    def _build_name_index(self) -> NameIndex:
+        """Walk the tree once and index every named file and directory entry."""
+        index = NameIndex()
+        parent_ids = {}
+        for parent, cluster, record in self._walk(self.boot["root_dir_first_cluster"]):
+            name = record["name"]
+            if name is None or record["entry_type"] in ["vol", "lfn"]:
+                continue
+            if name in [".", ".."]:
+                continue
+            if parent not in parent_ids:
+                parent_ids[parent] = len(index.parents)
+                index.parents.append(parent)
+            index.add(parent_ids[parent], cluster, record)
+        index.finish()
+        return index
+
+    def find(
+        self, pattern=None, ext=None, deleted=None, hashes=None, timestamps=False
+    ) -> list[dict]:
+        """Search file and directory names, returning the matches as parse_dir does.
+
+        pattern is a case-insensitive glob (e.g. "report*.doc") matched
+        against the names, or a compiled regular expression searched in
+        them. ext is an extension or a list of them (e.g. "docx" or [".jpg",
+        ".png"]). Both the short name and the long name, where the entry has
+        one (see _decode_entries()), are matched, and results carry both.
+        deleted selects only deleted (True) or live (False) entries; None
+        matches both. Filters combine with "and".
+
+        The name index is built on the first call by walking the directory
+        tree without reading any content, and is kept in self.name_index.
+        Content is read only for the matching entries, and each directory
+        holding a match is read once. hashes and timestamps are as for
+        parse_dir().
+
+        returns:
+            list[dict]: list of dictionaries, one dict per matching entry
+        """
+        if self.name_index is None:
+            self.name_index = self._build_name_index()
+        index = self.name_index
+
+        results = []
+        current = None
+        for i in index.match(pattern, ext, deleted):
+            cluster = index.dir_clusters[i]
+            # matches come in walk order, so each directory's are adjacent
+            # and it is read and decoded once
+            if cluster != current:
+                current = cluster
+                dir_sectors = self._get_sectors(cluster)
+                records = self._decode_entries(self._retrieve_data(cluster))
+            record = records[index.entry_nums[i]]
+            entry_dict = self._entry_dict(
+                index.parents[index.parent_ids[i]],
+                cluster,
+                dir_sectors,
+                record,
+                hashes,
+                timestamps,
+            )
+            entry_dict["long_name"] = record["long_name"]
+            results.append(entry_dict)
+        return results
+
+    def timeline(self) -> Timeline:
+        """Build a time-sorted index of every entry's timestamps.
+
+        Covers live and deleted entries alike (lfn and empty slots have no
+        timestamps); the . and .. links of each directory are skipped. The
+        rows are collected straight into arrays and sorted by an index
+        permutation, so no per-row objects are built.
+
+        returns:
+            Timeline: the index, ready for between() queries
+        """
+        times = array("d")
+        events = array("B")
+        entries = array("L")
+        paths = []
+        deleted = array("B")
+        for parent, _, record in self._walk(self.boot["root_dir_first_cluster"]):
+            if record["name"] in (None, ".", "..") or record["entry_type"] == "lfn":
+                continue
+            stamps = [
+                (event, record[name])
+                for event, name in enumerate(Timeline.EVENTS)
+                if record[name] is not None
+            ]
+            if not stamps:
+                continue
+            entry = len(paths)
+            paths.append(parent + "/" + record["name"])
+            deleted.append(record["deleted"])
+            for event, stamp in stamps:
+                times.append(_posix(stamp))
+                events.append(event)
+                entries.append(entry)
+
+        order = sorted(range(len(times)), key=times.__getitem__)
+        return Timeline(
+            array("d", (times[i] for i in order)),
+            array("B", (events[i] for i in order)),
+            array("L", (entries[i] for i in order)),
+            paths,
+            deleted,
+        )
+
+    def _extents(self, cluster: int, filesize: int) -> list[tuple[int, int]]:
+        """Return the (byte offset, length) runs holding a file's first filesize bytes."""
+        bytes_per_sector = self.boot["bytes_per_sector"]
+        extents = []
+        remaining = filesize
+        for sector in self._get_sectors(cluster):
+            if remaining <= 0:
+                break
+            length = min(bytes_per_sector, remaining)
+            offset = sector * bytes_per_sector
+            if extents and extents[-1][0] + extents[-1][1] == offset:
+                extents[-1] = (extents[-1][0], extents[-1][1] + length)
+            else:
+                extents.append((offset, length))
+            remaining -= length
+        return extents
+
+    def hash_files(
+        self, algorithms=("md5", "sha256"), workers=None, chunk_size=1024 * 1024
+    ) -> FileHashes:
+        """Hash the content of every allocated file in the tree.
+
+        Every file's extents are gathered first and then read once, in chunks
+        of at most chunk_size bytes, bypassing the block cache. Files whose
+        extents ascend on disk are read together in physical order across the
+        whole volume; files with an extent that jumps backwards are read
+        afterwards, each in file order. Chunks are hashed in a thread pool
+        while the next ones are read.
+
+        Deleted files are skipped, because their cluster chains are gone.
+        Zero-length files own no clusters; see FileHashes.lookup().
+
+        returns:
+            FileHashes: (content_cluster, filesize) -> {algorithm: hex digest}
+        """
+        hashers = {}
+        in_order = []
+        out_of_order = []
+        for _, _, record in self._walk(self.boot["root_dir_first_cluster"]):
+            cluster = record.get("content_cluster", 0)
+            if "filesize" not in record or record["deleted"] or cluster < 2:
+                continue
+            key = (cluster, record["filesize"])
+            if key in hashers or self._get_fat_entry(cluster) == 0:
+                continue
+            hashers[key] = _StreamHasher(algorithms)
+            extents = self._extents(cluster, record["filesize"])
+            ascending = all(a[0] < b[0] for a, b in zip(extents, extents[1:]))
+            reads = in_order if ascending else out_of_order
+            index = 0
+            for offset, length in extents:
+                for start in range(offset, offset + length, chunk_size):
+                    size = min(chunk_size, offset + length - start)
+                    reads.append((start, size, key, index))
+                    index += 1
+        in_order.sort()
+
+        workers = workers or os.cpu_count() or 1
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # Every chunk is submitted after the chunks before it in its file,
+            # so a hasher only waits on chunks still in flight, and at most
+            # limit chunks are held in memory at once.
+            in_flight = deque()
+            limit = 4 * workers
+            for start, size, key, index in in_order + out_of_order:
+                data = self.source.read(start, size)
+                in_flight.append(pool.submit(hashers[key].feed, index, data))
+                if len(in_flight) >= limit:
+                    in_flight.popleft().result()
+            for future in in_flight:
+                future.result()
+
+        return FileHashes(
+            algorithms,
+            {key: hasher.hexdigests() for key, hasher in hashers.items()},
+        )
+
+    def _subdirs(self, dir_data: bytes) -> list[tuple[int, str, int]]:
+        """Return (entry_num, name, cluster) for each subdirectory parse_dir would follow.
+
+        Works on the raw directory data and only decodes the names of the
+        directory entries, so it is cheap even for directories that are
+        otherwise left undecoded. Names are not unique (deleted FOO and BOO
+        are both _OO), so the entries are kept as a list.
+        """
+        subdirs = []
+        for count in range(2, len(dir_data) // 32):
+            entry = dir_data[count * 32 : (count + 1) * 32]
+            if hw4utils.get_entry_type(entry[11]) == "dir":
+                subdirs.append(
+                    (
+                        count,
+                        hw4utils.parse_name(entry),
+                        unpack(entry[26:28] + entry[20:22]),
+                    )
+                )
+        return subdirs
+
+    def _live_file_cluster(self, entry: bytes) -> int:
+        """Return the first cluster of a raw entry if it is a live file, else 0."""
+        if entry[0] == 0 or entry[0] == 0xE5:
+            return 0
+        if hw4utils.get_entry_type(entry[11]) in ["vol", "lfn", "dir"]:
+            return 0
+        return unpack(entry[26:28] + entry[20:22])
+
+    def _changed_clusters(self, other: "Fat") -> set[int]:
+        """Return the clusters whose FAT0 entries differ between self and other.
+
+        Both tables are streamed in bulk and compared a sector at a time, and
+        only sectors that differ are compared entry by entry.
+        """
+        block = self.boot["bytes_per_sector"]
+        changed = set()
+        pairs = zip_longest(self.fat.chunks(), other.fat.chunks(), fillvalue=(0, b""))
+        for (start, old), (other_start, new) in pairs:
+            start = max(start, other_start)
+            for i in range(0, max(len(old), len(new)), block):
+                if old[i : i + block] == new[i : i + block]:
+                    continue
+                for j in range(i, i + block, 4):
+                    if old[j : j + 4] != new[j : j + 4]:
+                        changed.add((start + j) // 4)
+        return changed
+
+    def _chain_changed(self, cluster: int, changed: set) -> bool:
+        """Return True if the cluster chain starting at cluster uses a changed FAT entry."""
+        seen = set()
+        while 2 <= cluster < 0x0FFFFFF8 and cluster not in seen:
+            if cluster in changed:
+                return True
+            seen.add(cluster)
+            cluster = self._get_fat_entry(cluster)
+        return False
+
+    def diff(self, other: "Fat") -> list[dict]:
+        """Compare this volume (the old snapshot) against other (the new one).
+
+        The FAT tables are compared first to find the clusters whose chains
+        changed. The directory trees are then walked together, pairing each
+        subdirectory with the one in the same slot of its parent, unless
+        that slot now holds a different directory. Children of a paired
+        directory are reported under its new path. A directory whose chain
+        and raw data are unchanged is not decoded at all; only its live
+        files' raw entries are checked for changed content chains. Content
+        is never read, so a file rewritten in place with the same clusters
+        and size is not reported.
+
+        Each change is a dict with the keys change, parent and entry_num,
+        plus old and/or new holding the decoded entries. change is one of:
+            - added: a used entry appeared in an empty slot (or new directory)
+            - removed: a used entry is gone (or its directory is gone)
+            - deleted: a live entry is now marked deleted
+            - modified: the entry kept its name but its bytes or its
+              content chain changed (content_changed tells which)
+
+        returns:
+            list[dict]: list of dictionaries, one dict per change
+        """
+        changed = self._changed_clusters(other)
+        changes = []
+        # (old cluster, new cluster, path); None when the side lacks the directory
+        pending = [
+            (
+                self.boot["root_dir_first_cluster"],
+                other.boot["root_dir_first_cluster"],
+                "",
+            )
+        ]
+        while pending:
+            old_cluster, new_cluster, parent = pending.pop()
+            old_data = b"" if old_cluster is None else self._retrieve_data(old_cluster)
+            new_data = b"" if new_cluster is None else other._retrieve_data(new_cluster)
+            # decode a directory only if its chain or raw data changed
+            if (
+                old_cluster == new_cluster
+                and old_data == new_data
+                and not self._chain_changed(old_cluster, changed)
+            ):
+                old_records = new_records = None
+            else:
+                old_records = self._decode_entries(old_data)
+                new_records = other._decode_entries(new_data)
+
+            for count in range(max(len(old_data), len(new_data)) // 32):
+                old_entry = old_data[count * 32 : (count + 1) * 32]
+                new_entry = new_data[count * 32 : (count + 1) * 32]
+                change = {"parent": parent, "entry_num": count}
+                if old_entry == new_entry:
+                    # same entry; only a live file's content chain can differ
+                    cluster = self._live_file_cluster(old_entry)
+                    if changed and cluster and self._chain_changed(cluster, changed):
+                        if old_records is None:
+                            old = new = self._decode_entry(old_entry, count)
+                        else:
+                            old, new = old_records[count], new_records[count]
+                        changes.append(
+                            {
+                                "change": "modified",
+                                **change,
+                                "old": old,
+                                "new": new,
+                                "content_changed": True,
+                            }
+                        )
+                    continue
+
+                old = old_records[count] if old_entry else None
+                new = new_records[count] if new_entry else None
+                if old is not None and old["name"] is None:
+                    old = None
+                if new is not None and new["name"] is None:
+                    new = None
+                if old is None and new is None:
+                    continue
+                elif new is None:
+                    changes.append({"change": "removed", **change, "old": old})
+                elif old is None:
+                    changes.append({"change": "added", **change, "new": new})
+                elif (
+                    new["deleted"]
+                    and not old["deleted"]
+                    and old["name"][1:] == new["name"][1:]
+                ):
+                    changes.append(
+                        {"change": "deleted", **change, "old": old, "new": new}
+                    )
+                elif old["name"] == new["name"]:
+                    cluster = self._live_file_cluster(old_entry)
+                    content_changed = bool(cluster) and (
+                        cluster != new["content_cluster"]
+                        or self._chain_changed(cluster, changed)
+                    )
+                    changes.append(
+                        {
+                            "change": "modified",
+                            **change,
+                            "old": old,
+                            "new": new,
+                            "content_changed": content_changed,
+                        }
+                    )
+                else:
+                    changes.append({"change": "removed", **change, "old": old})
+                    changes.append({"change": "added", **change, "new": new})
+
+            # pair subdirectories by slot, as long as the slot still holds
+            # the same directory: same first cluster, or the same name but
+            # for a first character changed by deletion
+            old_subdirs = {
+                count: (name, sub) for count, name, sub in self._subdirs(old_data)
+            }
+            new_subdirs = {
+                count: (name, sub) for count, name, sub in other._subdirs(new_data)
+            }
+            for count in sorted(old_subdirs.keys() | new_subdirs.keys()):
+                old = old_subdirs.get(count)
+                new = new_subdirs.get(count)
+                if old and new and (old[1] == new[1] or old[0][1:] == new[0][1:]):
+                    pending.append((old[1], new[1], parent + "/" + new[0]))
+                    continue
+                if old:
+                    pending.append((old[1], None, parent + "/" + old[0]))
+                if new:
+                    pending.append((None, new[1], parent + "/" + new[0]))
+
+        return changes
+
+    def parse_dir(
+        self, cluster: int, parent="", hashes=None, timestamps=False
+    ) -> list[dict]:
         """Parse a directory cluster, returns a list of dictionaries, one dict per entry.
 
         This function recursively parses any entry that is itself a directory.
@@ -271,74 +1423,302 @@ class Fat:
             - content: the first 128 bytes of the entry's content
             - slack: the slack data (up to 32 bytes)
 
+        If hashes (the result of hash_files()) is given, those entries also
+        have one key per hash algorithm, e.g. md5 and sha256, which are None
+        for files that were not hashed (such as deleted files).
+
+        If timestamps is True, every entry but lfn also has created, accessed
+        and modified (ISO 8601 strings, or None when unset).
+
         returns:
             list[dict]: list of dictionaries, one dict per entry
         """
         dict_list = []
-        count = 0
-        starting_byte = 0
         dir_data = self._retrieve_data(cluster)
+        dir_sectors = self._get_sectors(cluster)
 
-        while len(dir_data) - starting_byte >= 32:
-
-            directory_attribute = unpack(
-                dir_data[starting_byte + 11 : starting_byte + 12]
+        for record in self._decode_entries(dir_data):
+            entry_dict = self._entry_dict(
+                parent, cluster, dir_sectors, record, hashes, timestamps
             )
-            content_cluster_bytes = (
-                dir_data[starting_byte + 26 : starting_byte + 28]
-                + dir_data[starting_byte + 20 : starting_byte + 22]
-            )
-            content_cluster = unpack(content_cluster_bytes)
-            entry_type = hw4utils.get_entry_type(directory_attribute)
-
-            allocation_byte = unpack(dir_data[starting_byte : starting_byte + 1])
-            is_deleted = False
-            if allocation_byte == 0 or allocation_byte == 0xE5:
-                is_deleted = True
-
-            entry_dict = {
-                "parent": parent,
-                "dir_cluster": cluster,
-                "entry_num": count,
-                "dir_sectors": self._get_sectors(cluster),
-                "entry_type": entry_type,
-                "name": hw4utils.parse_name(
-                    dir_data[starting_byte : starting_byte + 32]
-                ),
-                "deleted": is_deleted,
-            }
-
-            if entry_type == "dir" and count >= 2:
-                entry_dict["content_cluster"] = content_cluster
+            if record["entry_type"] == "dir" and record["entry_num"] >= 2:
                 dict_list += self.parse_dir(
-                    content_cluster, parent + "/" + entry_dict["name"]
-                )
-
-            if entry_type not in ["vol", "lfn", "dir"]:
-                filesize = unpack(dir_data[starting_byte + 28 : starting_byte + 32])
-                entry_dict["filesize"] = filesize
-                entry_dict["content_cluster"] = content_cluster
-                entry_dict["content_sectors"] = self._get_sectors(content_cluster)
-                entry_dict["content"], entry_dict["slack"] = self._get_content(
-                    content_cluster, filesize
+                    record["content_cluster"],
+                    parent + "/" + entry_dict["name"],
+                    hashes,
+                    timestamps,
                 )
             dict_list.append(entry_dict)
 
-            count += 1
-            starting_byte += 32
-
         return dict_list
 
+    def _entry_dict(
+        self,
+        parent: str,
+        cluster: int,
+        dir_sectors: list[int],
+        record: dict,
+        hashes=None,
+        timestamps=False,
+    ) -> dict:
+        """Build the parse_dir dictionary for one decoded entry, reading its content."""
+        count = record["entry_num"]
+        entry_type = record["entry_type"]
+        entry_dict = {
+            "parent": parent,
+            "dir_cluster": cluster,
+            "entry_num": count,
+            "dir_sectors": list(dir_sectors),
+            "entry_type": entry_type,
+            "name": record["name"],
+            "deleted": record["deleted"],
+        }
+
+        if entry_type == "dir" and count >= 2:
+            entry_dict["content_cluster"] = record["content_cluster"]
+
+        if entry_type not in ["vol", "lfn", "dir"]:
+            content_cluster = record["content_cluster"]
+            filesize = record["filesize"]
+            entry_dict["filesize"] = filesize
+            entry_dict["content_cluster"] = content_cluster
+            entry_dict["content_sectors"] = self._get_sectors(content_cluster)
+            entry_dict["content"], entry_dict["slack"] = self._get_content(
+                content_cluster, filesize
+            )
+            if hashes is not None:
+                entry_dict.update(hashes.lookup(record))
+        if timestamps and entry_type != "lfn":
+            for name in Timeline.EVENTS:
+                stamp = record[name]
+                entry_dict[name] = stamp and stamp.isoformat()
+        return entry_dict
+
+
+def _is_fat32(boot_sector: bytes) -> bool:
+    """Return True if a 512-byte sector looks like a FAT32 boot sector."""
+    if len(boot_sector) < 512 or boot_sector[510:512] != b"\x55\xaa":
+        return False
+    bytes_per_sector = unpack(boot_sector[11:13])
+    sectors_per_cluster = unpack(boot_sector[13:14])
+    # FAT12/16 store their FAT size in the 16-bit field; FAT32 leaves it 0
+    return (
+        bytes_per_sector in (512, 1024, 2048, 4096)
+        and sectors_per_cluster > 0
+        and unpack(boot_sector[22:24]) == 0
+        and unpack(boot_sector[36:40]) > 0
+    )
+
+
+def _mbr_entries(sector: bytes) -> list[tuple[int, int]]:
+    """Return (type, first LBA) for each used entry of an MBR or EBR."""
+    entries = []
+    for i in range(4):
+        entry = sector[446 + i * 16 : 446 + (i + 1) * 16]
+        partition_type = entry[4]
+        first_lba = unpack(entry[8:12])
+        if partition_type != 0 and first_lba != 0:
+            entries.append((partition_type, first_lba))
+    return entries
+
+
+def _gpt_partitions(source, sector_size: int) -> list[int]:
+    """Return the first LBA of each used partition entry in a GPT."""
+    header = source.read(sector_size, 512)
+    if header[0:8] != b"EFI PART":
+        return []
+    entries_lba = unpack(header[72:80])
+    entry_count = unpack(header[80:84])
+    entry_size = unpack(header[84:88])
+    table = source.read(entries_lba * sector_size, entry_count * entry_size)
+
+    starts = []
+    for i in range(entry_count):
+        entry = table[i * entry_size : (i + 1) * entry_size]
+        # an all-zero type GUID marks an unused entry
+        if entry[0:16].strip(b"\x00"):
+            starts.append(unpack(entry[32:40]))
+    return starts
+
+
+def _sector_size(source) -> int:
+    """Return a disk's logical sector size: 4096 if its GPT header is there, else 512."""
+    for sector_size in (512, 4096):
+        if source.read(sector_size, 8) == b"EFI PART":
+            return sector_size
+    return 512
+
+
+def find_partitions(filename) -> list[int]:
+    """Return the byte offset of every FAT32 volume in a disk image.
+
+    A bare volume image returns [0]. Otherwise the MBR is parsed, following
+    extended partition chains, or the GPT if the MBR is protective. LBAs
+    are in logical sectors of 512 bytes, or 4096 when the GPT header is
+    found there. Type bytes and GUIDs are not trusted (FAT32 turns up under
+    0x0B, 0x0C, 0xEF, the EFI System GUID and more), so every partition is
+    a candidate and is returned only if it starts with a FAT32 boot sector.
+
+    returns:
+        list[int]: byte offsets, in partition table order
+    """
+    source = open_source(filename)
+    try:
+        sector0 = source.read(0, 512)
+        if _is_fat32(sector0):
+            return [0]
+        if sector0[510:512] != b"\x55\xaa":
+            return []
+        sector_size = _sector_size(source)
+
+        starts = []
+        for partition_type, first_lba in _mbr_entries(sector0):
+            if partition_type == GPT_PROTECTIVE_TYPE:
+                starts += _gpt_partitions(source, sector_size)
+            elif partition_type in EXTENDED_PARTITION_TYPES:
+                # each EBR holds one logical partition (relative to the EBR)
+                # and a link to the next EBR (relative to the extended start),
+                # in either slot
+                ebr_lba = first_lba
+                seen = set()
+                while ebr_lba not in seen:
+                    seen.add(ebr_lba)
+                    entries = _mbr_entries(source.read(ebr_lba * sector_size, 512))
+                    links = []
+                    for entry_type, lba in entries:
+                        if entry_type in EXTENDED_PARTITION_TYPES:
+                            links.append(lba)
+                        else:
+                            starts.append(ebr_lba + lba)
+                    if not links:
+                        break
+                    ebr_lba = first_lba + links[0]
+            else:
+                starts.append(first_lba)
+
+        offsets = []
+        for lba in starts:
+            if _is_fat32(source.read(lba * sector_size, 512)):
+                offsets.append(lba * sector_size)
+        return offsets
+    finally:
+        source.close()
+
+
+def _analyze_partition(
+    filename, offset: int, hash_files=False, timestamps=False
+) -> dict:
+    """Parse one FAT32 volume; runs in a worker process."""
+    fs = Fat(filename, offset)
+    hashes = fs.hash_files() if hash_files else None
+    return {
+        "offset": offset,
+        "boot": fs.boot,
+        "files": fs.parse_dir(
+            fs.boot["root_dir_first_cluster"], hashes=hashes, timestamps=timestamps
+        ),
+    }
+
+
+def analyze_partitions(
+    filename, offsets=None, workers=None, hash_files=False, timestamps=False
+) -> list[dict]:
+    """Parse every FAT32 volume in a disk image in parallel.
+
+    Each partition is read in place by its own worker process. If offsets
+    is None, they are found with find_partitions(). hash_files and
+    timestamps are passed on as for Fat.info().
+
+    returns:
+        list[dict]: one dict per partition with keys offset, boot, files
+    """
+    if offsets is None:
+        offsets = find_partitions(filename)
+    if len(offsets) <= 1:
+        return [
+            _analyze_partition(filename, offset, hash_files, timestamps)
+            for offset in offsets
+        ]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(
+            pool.map(
+                _analyze_partition,
+                [filename] * len(offsets),
+                offsets,
+                [hash_files] * len(offsets),
+                [timestamps] * len(offsets),
+            )
+        )
+
+
+def _volume_offsets(filename) -> list[int]:
+    """Return the offsets of the FAT32 volumes in an image for the commands.
+
+    As for the default command, an image without a recognised volume is
+    read as a bare volume at offset 0.
+    """
+    offsets = find_partitions(filename)
+    return offsets or [0]
+
 
 def main():
     # Parse command line arguments
-    if len(sys.argv) != 2:
-        print(f"usage:\n\t {os.path.basename(sys.argv[0])} filename")
+    args = sys.argv[1:]
+    hash_files = "--hash" in args
+    if hash_files:
+        args.remove("--hash")
+    timestamps = "--times" in args
+    if timestamps:
+        args.remove("--times")
+    if len(args) == 3 and args[0] == "diff":
+        old_offsets = _volume_offsets(args[1])
+        new_offsets = _volume_offsets(args[2])
+        if len(old_offsets) != len(new_offsets):
+            sys.exit(
+                f"diff: {args[1]} has {len(old_offsets)} FAT32 volumes"
+                f" but {args[2]} has {len(new_offsets)}"
+            )
+        # volumes are paired in partition table order
+        for old_offset, new_offset in zip(old_offsets, new_offsets):
+            if len(old_offsets) > 1:
+                print(json.dumps({"old_offset": old_offset, "new_offset": new_offset}))
+            old, new = Fat(args[1], old_offset), Fat(args[2], new_offset)
+            for change in old.diff(new):
+                print(json.dumps(change, default=datetime.isoformat))
+        return
+    if len(args) == 3 and args[0] == "find":
+        offsets = _volume_offsets(args[1])
+        for offset in offsets:
+            if len(offsets) > 1:
+                print(json.dumps({"partition_offset": offset}))
+            fs = Fat(args[1], offset)
+            hashes = fs.hash_files() if hash_files else None
+            for entry in fs.find(args[2], hashes=hashes, timestamps=timestamps):
+                print(json.dumps(entry))
+        return
+    if len(args) != 1:
+        program = os.path.basename(sys.argv[0])
+        print(
+            f"usage:\n\t {program} [--hash] [--times] filename"
+            f"\n\t {program} [--hash] [--times] find filename pattern"
+            f"\n\t {program} diff old new"
+        )
         exit()
-    filename = sys.argv[1]
+    filename = args[0]
     # Parse the file and print results
-    fs = Fat(filename)
-    fs.info()
+    offsets = find_partitions(filename)
+    if offsets == [0] or not offsets:
+        fs = Fat(filename)
+        fs.info(hash_files, timestamps)
+        return
+    # whole-disk image: print each partition's results in turn
+    for result in analyze_partitions(
+        filename, offsets, hash_files=hash_files, timestamps=timestamps
+    ):
+        print(json.dumps({"partition_offset": result["offset"]}))
+        print(json.dumps(result["boot"], indent=4))
+        for file in result["files"]:
+            print(json.dumps(file))
 
 
 if __name__ == "__main__":
@@ -1,3 +1,4 @@
+from datetime import datetime, timedelta
 from typing import Optional
 
 from beartype import beartype
@@ -55,6 +56,54 @@ def _parse_lfn(data: bytes) -> str:
     return lfn_str
 
 
+@beartype
+def lfn_checksum(short_name: bytes) -> int:
+    """Compute the checksum that LFN entries store for their short name
+
+    Based on Carrier's Table 10.7. Each LFN entry keeps, at byte 13, a
+    checksum of the 11-byte short name in the entry that follows the run,
+    so a run can be matched to its short entry.
+
+    returns:
+        int: checksum (0-255)
+    """
+    assert len(short_name) == 11, f"short_name is {len(short_name)} bytes; expected 11."
+    checksum = 0
+    for byte in short_name:
+        checksum = (((checksum & 1) << 7) + (checksum >> 1) + byte) & 0xFF
+    return checksum
+
+
+@beartype
+def parse_datetime(date: int, time: int = 0, tenths: int = 0) -> Optional[datetime]:
+    """Decode a FAT date, time and tenths-of-a-second triple
+
+    Based on Carrier's Table 10.5. The date packs the year since 1980,
+    month and day; the time packs hours, minutes and seconds/2. tenths
+    (really units of 10 ms, 0-199) refines the created time.
+
+    A zero date means the field was never set, and we return None,
+    as we do for values that are not a valid date.
+
+    returns:
+        datetime: naive timestamp (or None)
+    """
+    if date == 0:
+        return None
+    try:
+        result = datetime(
+            1980 + (date >> 9),
+            (date >> 5) & 0x0F,
+            date & 0x1F,
+            time >> 11,
+            (time >> 5) & 0x3F,
+            (time & 0x1F) * 2,
+        )
+    except ValueError:
+        return None
+    return result + timedelta(milliseconds=tenths * 10)
+
+
 @beartype
 def parse_name(entry: bytes) -> Optional[str]:
     """Decode the name of a directory entry
@@ -1,10 +1,24 @@
+import contextlib
+import gzip
+import hashlib
+import io
+import json
 import logging
+import os
+import re
+import struct
+import sys
+import tempfile
 import unittest
+import zlib
+from datetime import datetime, timezone
 from subprocess import run
+from unittest import mock
 
 from gradescope_utils.autograder_utils.decorators import partial_credit, weight
 
 import fsstat
+import hw4utils
 
 FILENAME = "fsstat.py"
 
@@ -394,5 +408,800 @@ class TestParseDir(unittest.TestCase):
         self.assertIn(slack_file, all_files)
 
 
+# The tests below build small synthetic FAT32 volumes instead of using the
+# assignment images: 512-byte sectors, 2 sectors per cluster, 2 FATs of
+# 600 sectors each.
+SECTORS_PER_FAT = 600
+TOTAL_SECTORS = 70000
+BIG_CONTENT = bytes((i * 7) % 251 for i in range(5000))
+ASCII_CONTENT = b"This is non-unicode content in a file. "
+REPORT_CONTENT = b"report contents here"
+# created 2020-03-14 10:30:10.5, accessed 2022-01-02, modified 2021-07-01 12:00
+STAMPS = {
+    "ctime": (10 << 11) | (30 << 5) | 5,
+    "cdate": (40 << 9) | (3 << 5) | 14,
+    "adate": (42 << 9) | (1 << 5) | 2,
+    "mtime": 12 << 11,
+    "mdate": (41 << 9) | (7 << 5) | 1,
+}
+
+
+def make_dirent(name: bytes, attr: int, cluster: int, size: int, stamped=True) -> bytes:
+    """Build a 32-byte short directory entry."""
+    entry = bytearray(32)
+    entry[0:11] = name.ljust(11)
+    entry[11] = attr
+    if stamped:
+        entry[13] = 50
+        struct.pack_into(
+            "<HHH", entry, 14, STAMPS["ctime"], STAMPS["cdate"], STAMPS["adate"]
+        )
+        struct.pack_into("<HH", entry, 22, STAMPS["mtime"], STAMPS["mdate"])
+    struct.pack_into("<H", entry, 20, cluster >> 16)
+    struct.pack_into("<H", entry, 26, cluster & 0xFFFF)
+    struct.pack_into("<I", entry, 28, size)
+    return bytes(entry)
+
+
+def make_lfn(long_name: str, short_name: bytes) -> bytes:
+    """Build the run of LFN entries that precedes a short entry."""
+    checksum = 0
+    for byte in short_name:
+        checksum = (((checksum & 1) << 7) + (checksum >> 1) + byte) & 0xFF
+    encoded = (long_name + "\x00").encode("utf-16-le")
+    encoded += b"\xff" * (-len(encoded) % 26)
+    entries = []
+    for i in range(len(encoded) // 26):
+        part = encoded[i * 26 : (i + 1) * 26]
+        entry = bytearray(32)
+        entry[0] = i + 1
+        entry[1:11], entry[14:26], entry[28:32] = part[:10], part[10:22], part[22:]
+        entry[11] = 0x0F
+        entry[13] = checksum
+        entries.append(entry)
+    entries[-1][0] |= 0x40
+    return b"".join(bytes(entry) for entry in reversed(entries))
+
+
+def make_volume(reserved=32, changed=False) -> bytes:
+    """Build a FAT32 volume; changed=True gives a later snapshot of it.
+
+    Root: ASSIGN4 (vol), ASCII.TXT, SUBDIR, BIG.BIN (fragmented over
+    clusters 10, 11, 20, 12, 13), EMPTY.TXT (zero length) and a deleted
+    OLD.TXT. SUBDIR holds report.docx (short name REPORT~1.DOC). The changed
+    snapshot deletes ASCII.TXT and adds SUBDIR/NEWFILE.TXT.
+    """
+    image = bytearray(TOTAL_SECTORS * 512)
+    boot = bytearray(512)
+    struct.pack_into("<HBHB", boot, 11, 512, 2, reserved, 2)
+    struct.pack_into("<I", boot, 32, TOTAL_SECTORS)
+    struct.pack_into("<I", boot, 36, SECTORS_PER_FAT)
+    struct.pack_into("<I", boot, 44, 2)
+    boot[82:90] = b"FAT32   "
+    boot[510:512] = b"\x55\xaa"
+    image[0:512] = boot
+    data_start = reserved + 2 * SECTORS_PER_FAT
+    fat = {0: 0x0FFFFFF8, 1: 0x0FFFFFFF}
+
+    def write_chain(chain, data):
+        for i, cluster in enumerate(chain):
+            fat[cluster] = chain[i + 1] if i + 1 < len(chain) else 0x0FFFFFFF
+            chunk = data[i * 1024 : (i + 1) * 1024]
+            start = ((cluster - 2) * 2 + data_start) * 512
+            image[start : start + len(chunk)] = chunk
+
+    subdir = (
+        make_dirent(b".", 0x10, 3, 0)
+        + make_dirent(b"..", 0x10, 0, 0)
+        + make_lfn("report.docx", b"REPORT~1DOC")
+        + make_dirent(b"REPORT~1DOC", 0x20, 5, len(REPORT_CONTENT))
+    )
+    ascii_name = b"ASCII   TXT"
+    if changed:
+        subdir += make_dirent(b"NEWFILE TXT", 0x20, 30, 3)
+        write_chain([30], b"new")
+        ascii_name = b"\xe5SCII   TXT"
+    else:
+        write_chain([7], ASCII_CONTENT)
+    root = (
+        make_dirent(b"ASSIGN4", 0x08, 0, 0, False)
+        + make_dirent(ascii_name, 0x20, 7, len(ASCII_CONTENT))
+        + make_dirent(b"SUBDIR", 0x10, 3, 0)
+        + make_dirent(b"BIG     BIN", 0x20, 10, len(BIG_CONTENT))
+        + make_dirent(b"EMPTY   TXT", 0x20, 0, 0)
+        + make_dirent(b"\xe5LD     TXT", 0x20, 8, 5)
+    )
+    write_chain([2], root)
+    write_chain([3], subdir)
+    write_chain([5], REPORT_CONTENT + b"The butler did it!")
+    write_chain([10, 11, 20, 12, 13], BIG_CONTENT)
+
+    for copy in range(2):
+        start = (reserved + copy * SECTORS_PER_FAT) * 512
+        for cluster, value in fat.items():
+            struct.pack_into("<I", image, start + cluster * 4, value)
+    return bytes(image)
+
+
+def write_image(directory, name: str, data: bytes) -> str:
+    """Write an image into directory and return its path."""
+    path = os.path.join(directory, name)
+    with open(path, "wb") as file:
+        file.write(data)
+    return path
+
+
+class SyntheticImageTest(unittest.TestCase):
+    """Base class providing a temporary directory holding one volume."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.volume = make_volume()
+        cls.filename = write_image(cls.tmp.name, "volume.dd", cls.volume)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+
+class TestBlockCache(SyntheticImageTest):
+    def test_reads_match_source(self):
+        source = fsstat.FileSource(self.filename)
+        cache = fsstat.BlockCache(source, 1024, max_bytes=4096, readahead=2)
+        for offset, size in [(0, 10), (1000, 3000), (600000, 1), (512, 8192)]:
+            self.assertEqual(
+                cache.read(offset, size), self.volume[offset : offset + size]
+            )
+        self.assertLessEqual(cache.stats()["bytes"], 4096)
+        source.close()
+
+    def test_hits_misses_and_readahead(self):
+        source = fsstat.FileSource(self.filename)
+        cache = fsstat.BlockCache(source, 1024, readahead=2)
+        cache.read(0, 1024)
+        self.assertEqual(cache.stats()["misses"], 1)
+        # blocks 1 and 2 came in by readahead
+        cache.read(1024, 2048)
+        self.assertEqual(
+            cache.stats(), {"hits": 2, "misses": 1, "blocks": 3, "bytes": 3072}
+        )
+        source.close()
+
+    def test_read_past_end(self):
+        source = fsstat.FileSource(self.filename)
+        cache = fsstat.BlockCache(source, 1024)
+        size = len(self.volume)
+        self.assertEqual(cache.read(size - 100, 1024), self.volume[-100:])
+        self.assertEqual(cache.read(size + 5000, 1024), b"")
+        source.close()
+
+    def test_blocks_aligned_to_data_start(self):
+        # 33 reserved sectors put data_start on an odd sector
+        filename = write_image(self.tmp.name, "odd.dd", make_volume(reserved=33))
+        fs = fsstat.Fat(filename, readahead=0)
+        self.assertEqual(fs.boot["data_start"], 1233)
+        self.assertEqual(fs._retrieve_data(7)[: len(ASCII_CONTENT)], ASCII_CONTENT)
+        self.assertEqual(fs.cache.stats()["misses"], 1)
+        self.assertEqual(fs.cache.stats()["blocks"], 1)
+
+    def test_parse_dir_repeats_use_cache(self):
+        fs = fsstat.Fat(self.filename)
+        first = fs.parse_dir(fs.boot["root_dir_first_cluster"])
+        misses = fs.cache.stats()["misses"]
+        self.assertEqual(fs.parse_dir(fs.boot["root_dir_first_cluster"]), first)
+        self.assertEqual(fs.cache.stats()["misses"], misses)
+
+    def test_truncated_image(self):
+        # cut the image inside BIG.BIN's chain (cluster 12 starts at sector 1252)
+        full = fsstat.Fat(self.filename).parse_dir(2)
+        filename = write_image(self.tmp.name, "cut.dd", self.volume[: 1252 * 512 + 100])
+        fs = fsstat.Fat(filename)
+        entries = fs.parse_dir(fs.boot["root_dir_first_cluster"])
+        self.assertEqual(len(entries), len(full))
+        self.assertEqual(len(fs._retrieve_data(10)), 4 * 512 + 100)
+
+
+class TestFatTable(SyntheticImageTest):
+    def setUp(self):
+        # 33 reserved sectors put the table off a 4096-byte boundary
+        self.aligned_volume = make_volume(reserved=33)
+        self.fs = fsstat.Fat(write_image(self.tmp.name, "fat.dd", self.aligned_volume))
+
+    def test_lazy(self):
+        self.assertEqual(self.fs.fat.pages.stats()["misses"], 0)
+        self.assertEqual(
+            self.fs._get_sectors(10),
+            [1249, 1250, 1251, 1252, 1269, 1270, 1253, 1254, 1255, 1256],
+        )
+        self.assertEqual(self.fs.fat.pages.stats()["misses"], 1)
+
+    def test_pages_start_at_table(self):
+        fat = self.fs.fat
+        self.assertEqual(fat.offset, 33 * 512)
+        self.assertEqual(fat.entry(10), 11)
+        self.assertEqual(
+            fat.pages._block(0), self.aligned_volume[fat.offset : fat.offset + 4096]
+        )
+
+    def test_entries_past_table(self):
+        fat = self.fs.fat
+        self.assertEqual(fat.size, SECTORS_PER_FAT * 512)
+        self.assertEqual(fat.entry(fat.size // 4), 0)
+        self.assertEqual(fat.entry(-1), 0)
+        self.assertEqual(fat.entry(fat.size // 4 - 1), 0)
+
+    def test_chunks(self):
+        fat = self.fs.fat
+        chunks = list(fat.chunks(chunk_size=100000))
+        self.assertEqual([start for start, _ in chunks], [0, 100000, 200000, 300000])
+        self.assertEqual(
+            b"".join(data for _, data in chunks),
+            self.aligned_volume[fat.offset : fat.offset + fat.size],
+        )
+
+    def test_memory_bound(self):
+        fs = fsstat.Fat(self.filename, fat_cache_bytes=8192)
+        for cluster in range(0, SECTORS_PER_FAT * 128, 1024):
+            fs.fat.entry(cluster)
+        self.assertLessEqual(fs.fat.pages.stats()["bytes"], 8192)
+
+
+def make_partition_entry(partition_type: int, first_lba: int, sectors: int) -> bytes:
+    """Build a 16-byte MBR partition entry."""
+    entry = bytearray(16)
+    entry[4] = partition_type
+    struct.pack_into("<II", entry, 8, first_lba, sectors)
+    return bytes(entry)
+
+
+def make_mbr_disk(primary: bytes, logical: bytes, link_first=False) -> bytes:
+    """Build a disk with primary at LBA 2048 (type 0xEF), a non-FAT partition,
+    and logical inside an extended partition.
+
+    With link_first, the EBR's first slot links to an empty second EBR and
+    the logical partition sits in its second slot.
+    """
+    primary_sectors = len(primary) // 512
+    junk_lba = 2048 + primary_sectors
+    extended_lba = junk_lba + 16
+    logical_sectors = len(logical) // 512
+    disk = bytearray((extended_lba + 63 + logical_sectors) * 512)
+
+    mbr = bytearray(512)
+    mbr[446:462] = make_partition_entry(0xEF, 2048, primary_sectors)
+    mbr[462:478] = make_partition_entry(0x83, junk_lba, 16)
+    mbr[478:494] = make_partition_entry(0x0F, extended_lba, 63 + logical_sectors)
+    mbr[510:512] = b"\x55\xaa"
+    disk[0:512] = mbr
+    ebr = bytearray(512)
+    if link_first:
+        ebr[446:462] = make_partition_entry(0x05, 1, 1)
+        ebr[462:478] = make_partition_entry(0x0C, 63, logical_sectors)
+        disk[(extended_lba + 1) * 512 + 510 : (extended_lba + 2) * 512] = b"\x55\xaa"
+    else:
+        ebr[446:462] = make_partition_entry(0x0C, 63, logical_sectors)
+    ebr[510:512] = b"\x55\xaa"
+    disk[extended_lba * 512 : extended_lba * 512 + 512] = ebr
+
+    disk[2048 * 512 : 2048 * 512 + len(primary)] = primary
+    start = (extended_lba + 63) * 512
+    disk[start : start + len(logical)] = logical
+    return bytes(disk)
+
+
+def make_gpt_disk(volume: bytes, sector_size=512) -> bytes:
+    """Build a GPT disk holding volume as an EFI System Partition at 1 MiB."""
+    first_lba = (1 << 20) // sector_size
+    sectors = -(-len(volume) // sector_size)
+    disk = bytearray((first_lba + sectors) * sector_size)
+    mbr = bytearray(512)
+    mbr[446:462] = make_partition_entry(0xEE, 1, 0xFFFFFFFF)
+    mbr[510:512] = b"\x55\xaa"
+    disk[0:512] = mbr
+    header = bytearray(512)
+    header[0:8] = b"EFI PART"
+    struct.pack_into("<QII", header, 72, 2, 128, 128)
+    disk[sector_size : sector_size + 512] = header
+    entry = bytearray(128)
+    entry[0:16] = bytes.fromhex("28732ac11ff8d211ba4b00a0c93ec93b")
+    struct.pack_into("<QQ", entry, 32, first_lba, first_lba + sectors - 1)
+    # entry 0 stays unused; the ESP is entry 1
+    table = 2 * sector_size
+    disk[table + 128 : table + 256] = entry
+    disk[1 << 20 : (1 << 20) + len(volume)] = volume
+    return bytes(disk)
+
+
+class TestPartitions(SyntheticImageTest):
+    def test_bare_volume(self):
+        self.assertEqual(fsstat.find_partitions(self.filename), [0])
+
+    def test_mbr_disk(self):
+        disk = make_mbr_disk(self.volume, make_volume(changed=True))
+        filename = write_image(self.tmp.name, "mbr.dd", disk)
+        primary_sectors = len(self.volume) // 512
+        logical_lba = 2048 + primary_sectors + 16 + 63
+        self.assertEqual(
+            fsstat.find_partitions(filename), [2048 * 512, logical_lba * 512]
+        )
+
+    def test_ebr_link_first(self):
+        disk = make_mbr_disk(self.volume, make_volume(changed=True), link_first=True)
+        filename = write_image(self.tmp.name, "mbr_link.dd", disk)
+        primary_sectors = len(self.volume) // 512
+        logical_lba = 2048 + primary_sectors + 16 + 63
+        self.assertEqual(
+            fsstat.find_partitions(filename), [2048 * 512, logical_lba * 512]
+        )
+
+    def test_gpt_4k_sectors(self):
+        disk = make_gpt_disk(self.volume, sector_size=4096)
+        filename = write_image(self.tmp.name, "gpt4k.dd", disk)
+        self.assertEqual(fsstat.find_partitions(filename), [1 << 20])
+
+    def test_gpt_disk(self):
+        filename = write_image(self.tmp.name, "gpt.dd", make_gpt_disk(self.volume))
+        self.assertEqual(fsstat.find_partitions(filename), [2048 * 512])
+        fs = fsstat.Fat(filename, 2048 * 512)
+        self.assertEqual(fs.parse_dir(2), fsstat.Fat(self.filename).parse_dir(2))
+
+    def test_analyze_partitions(self):
+        changed = make_volume(changed=True)
+        filename = write_image(
+            self.tmp.name, "mbr2.dd", make_mbr_disk(self.volume, changed)
+        )
+        results = fsstat.analyze_partitions(filename)
+        self.assertEqual(len(results), 2)
+        for result, volume in zip(results, [self.volume, changed]):
+            expected = fsstat.Fat(write_image(self.tmp.name, "part.dd", volume))
+            self.assertEqual(result["boot"], expected.boot)
+            self.assertEqual(result["files"], expected.parse_dir(2))
+
+
+def make_bgzf(data: bytes, block_size=65280) -> tuple[bytes, bytes]:
+    """Compress data as BGZF; return the file and its bgzip .gzi index."""
+    out = bytearray()
+    index = []
+    for start in range(0, len(data), block_size):
+        chunk = data[start : start + block_size]
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        body = compressor.compress(chunk) + compressor.flush()
+        block = bytearray(b"\x1f\x8b\x08\x04\0\0\0\0\0\xff\x06\0BC\x02\0\0\0")
+        block += body + struct.pack("<II", zlib.crc32(chunk), len(chunk))
+        struct.pack_into("<H", block, 16, len(block) - 1)
+        if start:
+            index.append(struct.pack("<QQ", len(out), start))
+        out += block
+    # the empty EOF marker block
+    out += bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+    return bytes(out), struct.pack("<Q", len(index)) + b"".join(index)
+
+
+def make_seekable_zstd(data: bytes, frame_size=1 << 20) -> bytes:
+    """Compress data in the zstd seekable format (no checksums)."""
+    compressor = fsstat.zstandard.ZstdCompressor()
+    out = bytearray()
+    table = bytearray()
+    for start in range(0, len(data), frame_size):
+        frame = compressor.compress(data[start : start + frame_size])
+        out += frame
+        table += struct.pack("<II", len(frame), len(data[start : start + frame_size]))
+    table += struct.pack("<IBI", len(data[::frame_size]), 0, 0x8F92EAB1)
+    return bytes(out + struct.pack("<II", 0x184D2A5E, len(table)) + table)
+
+
+class TestSources(SyntheticImageTest):
+    def assert_same_volume(self, filename):
+        fs = fsstat.Fat(filename)
+        self.assertEqual(fs.boot, fsstat.Fat(self.filename).boot)
+        self.assertEqual(fs.parse_dir(2), fsstat.Fat(self.filename).parse_dir(2))
+
+    def write_split(self, name: str, numbers) -> str:
+        size = len(self.volume) // 3 + 123
+        for number in numbers:
+            write_image(
+                self.tmp.name,
+                f"{name}.{number:03d}",
+                self.volume[(number - 1) * size : number * size],
+            )
+        return os.path.join(self.tmp.name, f"{name}.001")
+
+    def test_split_source(self):
+        filename = self.write_split("split", [1, 2, 3])
+        source = fsstat.open_source(filename)
+        self.assertIsInstance(source, fsstat.SplitSource)
+        boundary = len(self.volume) // 3 + 123
+        self.assertEqual(
+            source.read(boundary - 10, 20), self.volume[boundary - 10 : boundary + 10]
+        )
+        source.close()
+        self.assert_same_volume(filename)
+
+    def test_split_must_start_at_first_segment(self):
+        self.write_split("later", [1, 2, 3])
+        with self.assertRaises(ValueError):
+            fsstat.open_source(os.path.join(self.tmp.name, "later.002"))
+
+    def test_split_with_gap(self):
+        filename = self.write_split("gap", [1, 3])
+        with self.assertRaises(ValueError):
+            fsstat.open_source(filename)
+
+    def test_bgzf_source(self):
+        data, _ = make_bgzf(self.volume)
+        filename = write_image(self.tmp.name, "volume.bgz", data)
+        source = fsstat.open_source(filename)
+        self.assertIsInstance(source, fsstat.BgzfSource)
+        self.assertEqual(source.read(65000, 1000), self.volume[65000:66000])
+        # only the two blocks around the offset were decoded
+        self.assertEqual(source.stats()["misses"], 2)
+        source.close()
+        self.assert_same_volume(filename)
+
+    def test_bgzf_source_with_index(self):
+        data, index = make_bgzf(self.volume)
+        filename = write_image(self.tmp.name, "indexed.bgz", data)
+        write_image(self.tmp.name, "indexed.bgz.gzi", index)
+        self.assert_same_volume(filename)
+
+    def test_seekable_zstd_source(self):
+        if fsstat.zstandard is None:
+            self.skipTest("zstandard is not installed")
+        filename = write_image(
+            self.tmp.name, "volume.zst", make_seekable_zstd(self.volume)
+        )
+        source = fsstat.open_source(filename)
+        self.assertIsInstance(source, fsstat.ZstdSeekableSource)
+        self.assertEqual(
+            source.read((1 << 20) - 5, 10), self.volume[(1 << 20) - 5 : (1 << 20) + 5]
+        )
+        source.close()
+        self.assert_same_volume(filename)
+
+    def test_plain_gzip_rejected(self):
+        filename = write_image(self.tmp.name, "volume.gz", gzip.compress(b"abc"))
+        with self.assertRaises(ValueError):
+            fsstat.open_source(filename)
+
+
+def relink_fat(volume: bytes, links: dict) -> bytes:
+    """Return a copy of a synthetic volume with FAT entries overwritten."""
+    image = bytearray(volume)
+    for copy in range(2):
+        start = (32 + copy * SECTORS_PER_FAT) * 512
+        for cluster, value in links.items():
+            struct.pack_into("<I", image, start + cluster * 4, value)
+    return bytes(image)
+
+
+def patch_dir(volume: bytes, cluster: int, slot: int, entries: bytes) -> bytes:
+    """Return a copy of a synthetic volume with raw entries written into a
+    directory cluster, starting at entry number slot."""
+    image = bytearray(volume)
+    start = ((cluster - 2) * 2 + 32 + 2 * SECTORS_PER_FAT) * 512 + slot * 32
+    image[start : start + len(entries)] = entries
+    return bytes(image)
+
+
+def make_deleted_dirs(volume: bytes, changed=False) -> bytes:
+    """Add deleted directories FOO (cluster 40) and BOO (cluster 41) to the
+    root; both read as _OO. changed=True adds B.TXT to FOO."""
+    volume = relink_fat(volume, {40: 0x0FFFFFFF, 41: 0x0FFFFFFF})
+    volume = patch_dir(
+        volume,
+        2,
+        6,
+        make_dirent(b"\xe5OO", 0x10, 40, 0) + make_dirent(b"\xe5OO", 0x10, 41, 0),
+    )
+    for cluster in (40, 41):
+        volume = patch_dir(
+            volume,
+            cluster,
+            0,
+            make_dirent(b".", 0x10, cluster, 0)
+            + make_dirent(b"..", 0x10, 0, 0)
+            + make_dirent(b"A       TXT", 0x20, 0, 0),
+        )
+    if changed:
+        volume = patch_dir(volume, 40, 3, make_dirent(b"B       TXT", 0x20, 0, 0))
+    return volume
+
+
+class TestDiff(SyntheticImageTest):
+    def test_identical(self):
+        old = fsstat.Fat(self.filename)
+        with mock.patch.object(
+            fsstat.Fat, "_decode_entries", wraps=old._decode_entries
+        ) as decode:
+            self.assertEqual(old.diff(fsstat.Fat(self.filename)), [])
+        decode.assert_not_called()
+
+    def test_added_and_deleted(self):
+        new = write_image(self.tmp.name, "new.dd", make_volume(changed=True))
+        changes = fsstat.Fat(self.filename).diff(fsstat.Fat(new))
+        summary = [
+            (change["change"], change["parent"], change["entry_num"])
+            for change in changes
+        ]
+        self.assertEqual(sorted(summary), [("added", "/SUBDIR", 4), ("deleted", "", 1)])
+        deleted = changes[summary.index(("deleted", "", 1))]
+        self.assertEqual(deleted["old"]["name"], "ASCII.TXT")
+        self.assertEqual(deleted["new"]["name"], "_SCII.TXT")
+
+    def test_deleted_directory(self):
+        deleted = patch_dir(self.volume, 2, 2, b"\xe5")
+        new = write_image(self.tmp.name, "deleted_dir.dd", deleted)
+        changes = fsstat.Fat(self.filename).diff(fsstat.Fat(new))
+        self.assertEqual(
+            [(c["change"], c["parent"], c["entry_num"]) for c in changes],
+            [("deleted", "", 2)],
+        )
+        self.assertEqual(changes[0]["new"]["name"], "_UBDIR")
+
+    def test_deleted_names_collide(self):
+        old = write_image(self.tmp.name, "foo.dd", make_deleted_dirs(self.volume))
+        new = write_image(
+            self.tmp.name, "foo2.dd", make_deleted_dirs(self.volume, changed=True)
+        )
+        changes = fsstat.Fat(old).diff(fsstat.Fat(new))
+        self.assertEqual(
+            [(c["change"], c["parent"], c["entry_num"]) for c in changes],
+            [("added", "/_OO", 3)],
+        )
+        self.assertEqual(changes[0]["new"]["name"], "B.TXT")
+        # the walk follows both directories as well
+        self.assertEqual(
+            [e["parent"] for e in fsstat.Fat(old).find("a.txt")], ["/_OO", "/_OO"]
+        )
+
+    def test_whole_disk_command(self):
+        old = write_image(
+            self.tmp.name, "disk_old.dd", make_mbr_disk(self.volume, self.volume)
+        )
+        new = write_image(
+            self.tmp.name,
+            "disk_new.dd",
+            make_mbr_disk(self.volume, make_volume(changed=True)),
+        )
+        output = io.StringIO()
+        with mock.patch.object(sys, "argv", ["fsstat.py", "diff", old, new]):
+            with contextlib.redirect_stdout(output):
+                fsstat.main()
+        lines = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(lines[0]["old_offset"], 2048 * 512)
+        self.assertIn("new_offset", lines[1])
+        self.assertEqual(
+            sorted(line["change"] for line in lines[2:]), ["added", "deleted"]
+        )
+
+    def test_changed_chain_only(self):
+        # BIG.BIN's chain 10, 11, 20, 12, 13 now ends at 40 instead of 13
+        relinked = relink_fat(self.volume, {13: 40, 40: 0x0FFFFFFF})
+        new = write_image(self.tmp.name, "relinked.dd", relinked)
+        old = fsstat.Fat(self.filename)
+        with mock.patch.object(
+            fsstat.Fat, "_decode_entries", wraps=old._decode_entries
+        ) as decode:
+            changes = old.diff(fsstat.Fat(new))
+        decode.assert_not_called()
+        self.assertEqual(len(changes), 1)
+        self.assertEqual(changes[0]["change"], "modified")
+        self.assertEqual(changes[0]["old"]["name"], "BIG.BIN")
+        self.assertTrue(changes[0]["content_changed"])
+
+
+class TestHashFiles(SyntheticImageTest):
+    CONTENTS = {7: ASCII_CONTENT, 10: BIG_CONTENT, 5: REPORT_CONTENT}
+
+    def expected(self, algorithms=("md5", "sha256")):
+        return {
+            (cluster, len(data)): {
+                algorithm: hashlib.new(algorithm, data).hexdigest()
+                for algorithm in algorithms
+            }
+            for cluster, data in self.CONTENTS.items()
+        }
+
+    def test_digests(self):
+        hashes = fsstat.Fat(self.filename).hash_files()
+        self.assertEqual(dict(hashes), self.expected())
+        self.assertEqual(hashes.algorithms, ("md5", "sha256"))
+
+    def test_small_chunks(self):
+        hashes = fsstat.Fat(self.filename).hash_files(
+            algorithms=("sha1",), workers=2, chunk_size=512
+        )
+        self.assertEqual(dict(hashes), self.expected(("sha1",)))
+
+    def test_read_order(self):
+        fs = fsstat.Fat(self.filename)
+        list(fs._walk(2))  # warm the caches so only content reads remain
+        with mock.patch.object(fs.source, "read", wraps=fs.source.read) as read:
+            fs.hash_files(chunk_size=512)
+        offsets = [call.args[0] for call in read.call_args_list]
+        cluster_bytes = 1024
+        data_start = fs.boot["data_start"] * 512
+
+        def chunks(*clusters):
+            return [
+                data_start + (cluster - 2) * cluster_bytes + half
+                for cluster in clusters
+                for half in (0, 512)
+            ]
+
+        # ASCII.TXT and REPORT~1.DOC ascend on disk and are read first in
+        # physical order; BIG.BIN jumps back from 20 to 12 and follows in
+        # file order, without its final partial sector's padding.
+        big = chunks(10, 11, 20, 12, 13)[: -(-len(BIG_CONTENT) // 512)]
+        self.assertEqual(offsets, chunks(5)[:1] + chunks(7)[:1] + big)
+
+    def test_entries(self):
+        fs = fsstat.Fat(self.filename)
+        files = fs.parse_dir(2, hashes=fs.hash_files())
+        by_name = {entry["name"]: entry for entry in files}
+        self.assertEqual(
+            by_name["EMPTY.TXT"]["md5"], "d41d8cd98f00b204e9800998ecf8427e"
+        )
+        self.assertEqual(
+            by_name["EMPTY.TXT"]["sha256"],
+            "e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855",
+        )
+        self.assertIsNone(by_name["_LD.TXT"]["md5"])
+        self.assertEqual(
+            by_name["REPORT~1.DOC"]["sha256"],
+            hashlib.sha256(REPORT_CONTENT).hexdigest(),
+        )
+        self.assertNotIn("md5", by_name["SUBDIR"])
+
+    def test_keys_without_digests(self):
+        fs = fsstat.Fat(self.filename)
+        files = fs.parse_dir(2, hashes=fsstat.FileHashes(("md5",)))
+        big = next(entry for entry in files if entry["name"] == "BIG.BIN")
+        self.assertIn("md5", big)
+        self.assertIsNone(big["md5"])
+
+    def test_cross_linked(self):
+        # a live 100-byte entry sharing BIG.BIN's first cluster
+        volume = patch_dir(
+            self.volume, 2, 6, make_dirent(b"HEAD    BIN", 0x20, 10, 100)
+        )
+        fs = fsstat.Fat(write_image(self.tmp.name, "cross.dd", volume))
+        files = fs.parse_dir(2, hashes=fs.hash_files())
+        by_name = {entry["name"]: entry for entry in files}
+        self.assertEqual(
+            by_name["BIG.BIN"]["md5"], hashlib.md5(BIG_CONTENT).hexdigest()
+        )
+        self.assertEqual(
+            by_name["HEAD.BIN"]["md5"], hashlib.md5(BIG_CONTENT[:100]).hexdigest()
+        )
+
+
+class TestTimeline(SyntheticImageTest):
+    CREATED = datetime(2020, 3, 14, 10, 30, 10, 500000)
+    ACCESSED = datetime(2022, 1, 2)
+    MODIFIED = datetime(2021, 7, 1, 12)
+    PATHS = ["/ASCII.TXT", "/SUBDIR", "/BIG.BIN", "/EMPTY.TXT", "/_LD.TXT"]
+
+    def test_parse_datetime(self):
+        self.assertEqual(
+            hw4utils.parse_datetime(STAMPS["cdate"], STAMPS["ctime"], 50),
+            self.CREATED,
+        )
+        self.assertEqual(hw4utils.parse_datetime(STAMPS["adate"]), self.ACCESSED)
+        self.assertIsNone(hw4utils.parse_datetime(0, STAMPS["ctime"]))
+        # month 13 is not a date
+        self.assertIsNone(hw4utils.parse_datetime((40 << 9) | (13 << 5) | 1))
+
+    def test_rows(self):
+        timeline = fsstat.Fat(self.filename).timeline()
+        # six stamped entries; ASSIGN4 has no stamps and . and .. are skipped
+        self.assertEqual(len(timeline), 18)
+        rows = timeline.between()
+        self.assertEqual(
+            sorted({row["path"] for row in rows}),
+            sorted(self.PATHS + ["/SUBDIR/REPORT~1.DOC"]),
+        )
+        self.assertEqual([row["event"] for row in rows[:6]], ["created"] * 6)
+        self.assertEqual([row["event"] for row in rows[-6:]], ["accessed"] * 6)
+        self.assertEqual(rows[0]["time"], self.CREATED.isoformat())
+        self.assertEqual(list(timeline.times), sorted(timeline.times))
+
+    def test_between(self):
+        timeline = fsstat.Fat(self.filename).timeline()
+        rows = timeline.between(datetime(2021, 1, 1), datetime(2021, 12, 31))
+        self.assertEqual({row["event"] for row in rows}, {"modified"})
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(len(timeline.between(self.MODIFIED, self.MODIFIED)), 6)
+        deleted = [row for row in timeline.between(end=self.CREATED) if row["deleted"]]
+        self.assertEqual([row["path"] for row in deleted], ["/_LD.TXT"])
+        posix = self.ACCESSED.replace(tzinfo=timezone.utc).timestamp()
+        self.assertEqual(len(timeline.between(start=posix)), 6)
+        self.assertEqual(timeline.between(start=datetime(2030, 1, 1)), [])
+
+    def test_entry_timestamps(self):
+        fs = fsstat.Fat(self.filename)
+        files = fs.parse_dir(2, timestamps=True)
+        ascii_txt = next(entry for entry in files if entry["name"] == "ASCII.TXT")
+        self.assertEqual(ascii_txt["created"], "2020-03-14T10:30:10.500000")
+        self.assertEqual(ascii_txt["modified"], "2021-07-01T12:00:00")
+        label = next(entry for entry in files if entry["name"] == "ASSIGN4")
+        self.assertIsNone(label["accessed"])
+
+
+class TestFind(SyntheticImageTest):
+    def setUp(self):
+        self.fs = fsstat.Fat(self.filename)
+
+    def names(self, *args, **kwargs) -> list:
+        return [entry["name"] for entry in self.fs.find(*args, **kwargs)]
+
+    def test_long_name(self):
+        for results in (self.fs.find("*.docx"), self.fs.find(ext="docx")):
+            self.assertEqual(len(results), 1)
+            self.assertEqual(results[0]["name"], "REPORT~1.DOC")
+            self.assertEqual(results[0]["long_name"], "report.docx")
+            self.assertEqual(results[0]["parent"], "/SUBDIR")
+            self.assertEqual(results[0]["content"], repr(REPORT_CONTENT))
+        # the short name is indexed too, and each entry is returned once
+        self.assertEqual(self.names("REPORT~1.DOC"), ["REPORT~1.DOC"])
+        self.assertEqual(self.names(ext="doc"), ["REPORT~1.DOC"])
+        self.assertEqual(self.names("report*"), ["REPORT~1.DOC"])
+        self.assertEqual(self.names(ext=["doc", "docx"]), ["REPORT~1.DOC"])
+        self.assertEqual(self.names(re.compile(r"(?i)report")), ["REPORT~1.DOC"])
+
+    def test_checksum_mismatch(self):
+        run = make_lfn("report.docx", b"REPORT~1DOC")
+        self.assertEqual(fsstat._long_name([run], b"REPORT~1DOC"), "report.docx")
+        self.assertIsNone(fsstat._long_name([run], b"REPORT~2DOC"))
+
+    def test_globs(self):
+        self.assertEqual(self.names("*.txt"), ["ASCII.TXT", "EMPTY.TXT", "_LD.TXT"])
+        self.assertEqual(self.names("b?g.*"), ["BIG.BIN"])
+        self.assertEqual(self.names("subdir"), ["SUBDIR"])
+        self.assertEqual(
+            self.names(ext=[".bin", "TXT"], deleted=False),
+            ["ASCII.TXT", "BIG.BIN", "EMPTY.TXT"],
+        )
+
+    def test_regex_and_deleted(self):
+        self.assertEqual(self.names(re.compile(r"^re.*x$")), ["REPORT~1.DOC"])
+        self.assertEqual(self.names(deleted=True), ["_LD.TXT"])
+        self.assertNotIn(".", self.names())
+        self.assertNotIn("ASSIGN4", self.names())
+
+    def test_whole_disk_command(self):
+        disk = write_image(
+            self.tmp.name, "find_disk.dd", make_mbr_disk(self.volume, self.volume)
+        )
+        output = io.StringIO()
+        with mock.patch.object(sys, "argv", ["fsstat.py", "find", disk, "*.docx"]):
+            with contextlib.redirect_stdout(output):
+                fsstat.main()
+        lines = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual(
+            [line.get("partition_offset") for line in lines[::2]],
+            [2048 * 512, (2048 + len(self.volume) // 512 + 16 + 63) * 512],
+        )
+        self.assertEqual(
+            [line["long_name"] for line in lines[1::2]], ["report.docx"] * 2
+        )
+
+    def test_reads_each_directory_once(self):
+        self.fs.find()  # build the index
+        with mock.patch.object(
+            fsstat.Fat, "_retrieve_data", wraps=self.fs._retrieve_data
+        ) as retrieve, mock.patch.object(
+            fsstat.Fat, "_decode_entries", wraps=self.fs._decode_entries
+        ) as decode:
+            results = self.fs.find("*")
+        self.assertEqual(len(results), 6)
+        self.assertEqual(decode.call_count, 2)
+        # content clusters are read too; the root and SUBDIR only once each
+        clusters = [call.args[0] for call in retrieve.call_args_list]
+        self.assertEqual([cluster for cluster in clusters if cluster in (2, 3)], [2, 3])
+
+
 if __name__ == "__main__":
     unittest.main()